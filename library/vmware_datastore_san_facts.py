@@ -26,18 +26,27 @@ author:
 - Avinash Jalumuru <avinash.jalumuru@hpe.com>
 notes:
 - Tested on vSphere 6.0 and 6.5
+- The vCenter session cookie is kept under ~/.ansible/tmp and reused by later runs instead of logging in again.
 requirements:
 - python >= 2.6
 - PyVmomi
 options:
   datastore_name:
     description:
-    - Name of the datastore to add/remove.
-    required: true
+    - Name of the datastore to gather facts about.
+    - Combined with C(esxi_hostname), only the datastores of that host are searched.
+    required: false
   esxi_hostname:
     description:
-    - ESXi hostname to manage the datastore.
-    required: true
+    - ESXi hostname whose datastores are returned.
+    required: false
+  all_datastores:
+    description:
+    - Return facts of every datastore in vCenter.
+    - Required when neither C(datastore_name) nor C(esxi_hostname) is set.
+    type: bool
+    default: false
+    version_added: '0.2'
 extends_documentation_fragment: vmware.documentation
 '''
 
@@ -62,58 +71,52 @@ except ImportError:
     HAS_PYVMOMI = False
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.vmware import (HAS_PYVMOMI, vmware_argument_spec, find_datastore_by_name, get_all_objs,
-                                         wait_for_task, find_hostsystem_by_name, find_cluster_by_name, connect_to_api)
+from ansible.module_utils.vmware import vmware_argument_spec, find_datastore_by_name, find_hostsystem_by_name
+from ansible.module_utils.vmware_san import (PyVmomiSan, get_cached_objs, object_specs, read_datastores,
+                                             retrieve_properties)
 from ansible.module_utils._text import to_native
 
-class VMwareDatastore(object):
+class VMwareDatastore(PyVmomiSan):
     def __init__(self, module):
+        super(VMwareDatastore, self).__init__(module)
         self.datastore_name = module.params.get('datastore_name')
         self.esxi_hostname = module.params.get('esxi_hostname')
-        self.content = connect_to_api(module)
-        self.module = module
 
     def gather_facts(self):
-        datastores = list()
-        if self.datastore_name:
-            datastore = find_datastore_by_name(self.content, self.datastore_name)
-            datastores.extend([self.read_datastore(datastore)])
-            return datastores
-        elif self.esxi_hostname:
+        if self.esxi_hostname:
             host = find_hostsystem_by_name(self.content, self.esxi_hostname)
+            if host is None:
+                self.module.fail_json(msg="Failed to find ESXi hostname %s" % self.esxi_hostname)
             vmware_datastores = host.datastore
+            if self.datastore_name:
+                # Only look among the datastores mounted on the host
+                ds_names = retrieve_properties(self.content, object_specs(vmware_datastores), vim.Datastore, ['name'])
+                vmware_datastores = [ds for ds, props in ds_names if props['name'] == self.datastore_name]
+                if not vmware_datastores:
+                    self.module.fail_json(msg="Failed to find datastore %s on host %s" % (self.datastore_name,
+                                                                                          self.esxi_hostname))
+        elif self.datastore_name:
+            datastore = find_datastore_by_name(self.content, self.datastore_name)
+            if datastore is None:
+                self.module.fail_json(msg="Failed to find datastore %s" % self.datastore_name)
+            vmware_datastores = [datastore]
         else:
-            vmware_datastores = get_all_objs(self.content, [vim.Datastore])
+            vmware_datastores = get_cached_objs(self.content, [vim.Datastore])
 
-        for datastore in vmware_datastores:
-            datastores.extend([self.read_datastore(datastore)])
-        return datastores
+        return self.read_datastores(vmware_datastores)
 
-    def read_datastore(self, datastore):
+    def read_datastores(self, vmware_datastores):
         try:
-            ds = {}
-            summary = datastore.summary
-            ds['name'] = summary.name
-            ds['maintenanceMode'] = summary.maintenanceMode
-            ds['url'] = summary.url
-            ds['datastore_cluster'] = 'N/A'
-            if isinstance(datastore.parent, vim.StoragePod):
-                ds['datastore_cluster'] = datastore.parent.name
-
-            vmfs = datastore.info.vmfs
-            ds['vmfs_type'] = vmfs.type
-            ds['wwn'] = [ x.diskName.split('.')[-1] for x in vmfs.extent]
-            return ds
+            return read_datastores(self.content, vmware_datastores)
         except (vmodl.RuntimeFault, vmodl.MethodFault) as vmodl_fault:
             self.module.fail_json(msg=to_native(vmodl_fault.msg))
-        except Exception as e:
-            self.module.fail_json(msg=to_native(e))
 
 def main():
     argument_spec = vmware_argument_spec()
     argument_spec.update(
         datastore_name=dict(type='str', required=False),
-        esxi_hostname=dict(type='str', required=False)
+        esxi_hostname=dict(type='str', required=False),
+        all_datastores=dict(type='bool', default=False)
     )
 
     module = AnsibleModule(
@@ -124,6 +127,10 @@ def main():
     if not HAS_PYVMOMI:
         module.fail_json(msg='pyvmomi is required for this module')
 
+    # Refuse to walk every datastore in vCenter unless asked to
+    if not (module.params['datastore_name'] or module.params['esxi_hostname'] or module.params['all_datastores']):
+        module.fail_json(msg='one of datastore_name, esxi_hostname or all_datastores is required')
+
     try:
         vmware_datastore = VMwareDatastore(module)
         datastores = vmware_datastore.gather_facts()
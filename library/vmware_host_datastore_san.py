@@ -26,6 +26,7 @@ author:
 - Avinash Jalumuru <avinash.jalumuru@hpe.com>
 notes:
 - Tested on vSphere 6.0 and 6.5
+- The vCenter session cookie is kept under ~/.ansible/tmp and reused by later runs instead of logging in again.
 requirements:
 - python >= 2.6
 - PyVmomi
@@ -33,7 +34,33 @@ options:
   datastore_name:
     description:
     - Name of the datastore to add/remove.
-    required: true
+    - Mutually exclusive with C(datastores), one of them is required.
+  datastores:
+    description:
+    - List of datastores to add/remove in a single run, sharing one vCenter session and rescan.
+    - Mutually exclusive with C(datastore_name), C(volume_device_name) and C(datastore_cluster_name).
+    - A failure on one datastore does not stop the others, the module fails at the end with all results.
+    type: list
+    elements: dict
+    suboptions:
+      name:
+        description:
+        - Name of the datastore to add/remove.
+        type: str
+        required: true
+      volume_device_name:
+        description:
+        - Name of the device to be used as VMFS datastore.
+        type: str
+      datastore_cluster_name:
+        description:
+        - Name of the datastore cluster to move the new datastore into.
+        type: str
+    version_added: '0.2'
+  datastore_cluster_name:
+    description:
+    - Name of the datastore cluster to move a newly created datastore into.
+    required: false
   datacenter_name:
     description:
     - Name of the datacenter to add the datastore.
@@ -51,6 +78,13 @@ options:
     - "absent: Umount datastore if datastore is present else do nothing."
     default: present
     choices: [ present, absent ]
+  async_poll:
+    description:
+    - If set, do not wait for the move of a new datastore into C(datastore_cluster_name).
+    - The task id is returned as C(task_moid) in C(results), use M(vmware_task_status) to wait for it.
+    type: bool
+    default: false
+    version_added: '0.2'
 extends_documentation_fragment: vmware.documentation
 '''
 
@@ -77,9 +111,36 @@ EXAMPLES = r'''
       esxi_hostname: '{{ inventory_hostname }}'
       state: absent
   delegate_to: localhost
+
+- name: Mount several VMFS datastores to ESXi in one task
+  vmware_host_datastore_san:
+      hostname: '{{ vcenter_hostname }}'
+      username: '{{ vcenter_user }}'
+      password: '{{ vcenter_pass }}'
+      datastores:
+      - name: San_datastore01
+        volume_device_name: 'XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX'
+      - name: San_datastore02
+        volume_device_name: 'YYYYYYYYYYYYYYYYYYYYYYYYYYYYYYYY'
+      esxi_hostname: '{{ inventory_hostname }}'
+      state: present
+  delegate_to: localhost
 '''
 
 RETURN = r'''
+results:
+    description: Outcome for each requested datastore.
+    returned: always
+    type: list
+    sample: [{"datastore_name": "San_datastore01", "changed": true, "result": "Datastore San_datastore01 on host esxi01"}]
+    contains:
+        failed:
+            description: Set when this datastore could not be handled, C(msg) holds the error.
+            type: bool
+        task_moid:
+            description: Id of the still running MoveIntoFolder task when C(async_poll) is set.
+            type: str
+            sample: task-1234
 '''
 
 try:
@@ -88,139 +149,255 @@ except ImportError:
     pass
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.vmware import vmware_argument_spec, PyVmomi, find_datastore_by_name, get_all_objs, wait_for_task
+from ansible.module_utils.vmware import vmware_argument_spec, wait_for_task, TaskError
+from ansible.module_utils.vmware_san import (PyVmomiSan, get_datastores_by_name, get_folders_by_name, object_specs,
+                                             retrieve_properties, run_in_parallel, extract_wwns, get_lun_names,
+                                             rescan_hosts)
 from ansible.module_utils._text import to_native
 
-class VMwareHostSanDatastore(PyVmomi):
+class DatastoreError(Exception):
+    """Failure of a single datastore, reported in results without stopping the others."""
+
+
+class VMwareHostSanDatastore(PyVmomiSan):
     def __init__(self, module):
         super(VMwareHostSanDatastore, self).__init__(module)
 
-        self.datastore_name = module.params['datastore_name']
         self.esxi_hostname = module.params['esxi_hostname']
-        self.volume_device_name = module.params.get('volume_device_name')
         self.state = module.params['state']
-        self.datastore_cluster_name = module.params.get('datastore_cluster_name')
+        self.async_poll = module.params['async_poll']
+        # naa ids of LUNs that got a new datastore, peer hosts are rescanned for these
+        self.new_device_names = set()
+        self.datastore_folder_children = None
+        self.host_lun_names = None
+
+        if module.params.get('datastores'):
+            self.datastores = [dict(name=x['name'],
+                                    volume_device_name=x.get('volume_device_name'),
+                                    datastore_cluster_name=x.get('datastore_cluster_name'))
+                               for x in module.params['datastores']]
+        else:
+            self.datastores = [dict(name=module.params['datastore_name'],
+                                    volume_device_name=module.params.get('volume_device_name'),
+                                    datastore_cluster_name=module.params.get('datastore_cluster_name'))]
 
         self.esxi = self.find_hostsystem_by_name(self.esxi_hostname)
         if self.esxi is None:
             self.module.fail_json(msg="Failed to find ESXi hostname %s " % self.esxi_hostname)
 
-        if self.volume_device_name:
-            self.volume_device_name = self.volume_device_name.lower()
+        # Fetch the host references used by every state in one call
+        host_props = retrieve_properties(self.content, object_specs([self.esxi]), vim.HostSystem,
+                                         ['configManager.datastoreSystem', 'configManager.storageSystem', 'parent'])
+        props = host_props[0][1] if host_props else {}
+        self.host_ds_system = props.get('configManager.datastoreSystem') or self.esxi.configManager.datastoreSystem
+        self.host_storage_system = props.get('configManager.storageSystem') or self.esxi.configManager.storageSystem
+        self.host_parent = props.get('parent') or self.esxi.parent
+
+        for spec in self.datastores:
+            if spec['volume_device_name']:
+                spec['volume_device_name'] = spec['volume_device_name'].lower()
 
     def process_state(self):
         ds_states = {
             'present': self.mount_san_datastore_host,
             'absent': self.umount_san_datastore_host
         }
+        if self.module.check_mode:
+            # Report what would change from the datastores already visible, without rescans or changes
+            results = []
+            datastores_by_name = get_datastores_by_name(self.content)
+            for spec in self.datastores:
+                exists = spec['name'] in datastores_by_name
+                results.append(dict(datastore_name=spec['name'],
+                                    changed=not exists if self.state == 'present' else exists))
+            self.module.exit_json(changed=any(x['changed'] for x in results), results=results)
+
+        results = []
         try:
-            datastore = self.check_datastore_host_state()
-            ds_states[self.state](datastore)
+            try:
+                for spec, datastore in self.check_datastore_host_state():
+                    try:
+                        results.append(ds_states[self.state](spec, datastore))
+                    except (DatastoreError, TaskError, vmodl.RuntimeFault, vmodl.MethodFault) as e:
+                        # Keep going so the datastores that did get created are still rescanned below
+                        msg = to_native(e.msg) if isinstance(e, vmodl.MethodFault) else to_native(e)
+                        created = "naa." + str(spec['volume_device_name']) in self.new_device_names
+                        results.append(dict(datastore_name=spec['name'], changed=created, failed=True, msg=msg))
+            finally:
+                if self.new_device_names:
+                    self.rescan_other_hosts_in_cluster()
         except (vmodl.RuntimeFault, vmodl.MethodFault) as vmodl_fault:
-            self.module.fail_json(msg=to_native(vmodl_fault.msg))
-        except Exception as e:
-            self.module.fail_json(msg=to_native(e))
-
-    def state_exit_unchanged(self):
-        self.module.exit_json(changed=False)
+            self.module.fail_json(msg=to_native(vmodl_fault.msg), results=results)
+        self.exit_with_results(results)
+
+    def exit_with_results(self, results):
+        changed = any(x['changed'] for x in results)
+        failed = [x for x in results if x.get('failed')]
+        if failed:
+            self.module.fail_json(msg="; ".join(x['msg'] for x in failed), changed=changed, results=results)
+        if self.module.params.get('datastores') or not changed:
+            self.module.exit_json(changed=changed, results=results)
+        self.module.exit_json(changed=changed, result=results[0]['result'], results=results)
 
     def check_datastore_host_state(self):
-        self.esxi.configManager.storageSystem.RescanAllHba()
-        return self.find_datastore_by_name(self.datastore_name)
-
-    def umount_san_datastore_host(self, datastore):
+        """Return (spec, datastore) pairs for every requested datastore, rescanning the
+        host once if any datastore to be mounted is not visible yet or may be expanded."""
+        datastores_by_name = get_datastores_by_name(self.content)
+        datastores = [(spec, datastores_by_name.get(spec['name'])) for spec in self.datastores]
+        if self.state == 'present' and any(self.needs_rescan(spec, datastore) for spec, datastore in datastores):
+            # Rescan for LUNs the host has not seen yet and for grown LUNs before the expand query
+            self.host_storage_system.RescanAllHba()
+            if any(datastore is None for dummy, datastore in datastores):
+                datastores_by_name = get_datastores_by_name(self.content, refresh=True)
+                datastores = [(spec, datastore or datastores_by_name.get(spec['name']))
+                              for spec, datastore in datastores]
+        return datastores
+
+    def needs_rescan(self, spec, datastore):
+        if datastore is None:
+            return True
+        return bool(spec['volume_device_name']) and \
+            spec['volume_device_name'] in extract_wwns(datastore.info.vmfs.extent)
+
+    def umount_san_datastore_host(self, spec, datastore):
         if not datastore:
-            self.module.exit_json(changed=False)
+            return dict(datastore_name=spec['name'], changed=False)
 
-        error_message_umount = "Cannot umount datastore %s from host %s" % (self.datastore_name, self.esxi_hostname)
+        error_message_umount = "Cannot umount datastore %s from host %s" % (spec['name'], self.esxi_hostname)
         try:
             #task = datastore.DatastoreEnterMaintenanceMode()
             #success, result = wait_for_task(task)
-            for host in datastore.host:
-                host.key.configManager.storageSystem.UnmountVmfsVolume(datastore.info.vmfs.uuid)
+            vmfs_uuid = datastore.info.vmfs.uuid
+            umount_futures = run_in_parallel(lambda host: host.key.configManager.storageSystem.UnmountVmfsVolume(vmfs_uuid),
+                                             datastore.host)
+            for future in umount_futures:
+                future.result()
 
-            self.esxi.configManager.datastoreSystem.RemoveDatastore(datastore)
+            self.host_ds_system.RemoveDatastore(datastore)
         except (vim.fault.NotFound, vim.fault.HostConfigFault, vim.fault.ResourceInUse) as fault:
-            self.module.fail_json(msg="%s: %s" % (error_message_umount, to_native(fault.msg)))
-        except Exception as e:
-            self.module.fail_json(msg="%s: %s" % (error_message_umount, to_native(e)))
-        self.module.exit_json(changed=True, result="Datastore %s on host %s" % (self.datastore_name, self.esxi_hostname))
+            raise DatastoreError("%s: %s" % (error_message_umount, to_native(fault.msg)))
+        return dict(datastore_name=spec['name'], changed=True,
+                    result="Datastore %s on host %s" % (spec['name'], self.esxi_hostname))
 
     def rescan_other_hosts_in_cluster(self):
-        cluster_hosts = self.get_all_hosts_by_cluster(self.esxi.parent.name)
-        for host in cluster_hosts:
-            if host.name != self.esxi_hostname:
-                host.configManager.storageSystem.RescanAllHba()
-                host.configManager.storageSystem.RescanVmfs()
-
-    def mount_san_datastore_host(self, datastore):
-        ds_path = "/vmfs/devices/disks/naa." + str(self.volume_device_name)
-        host_ds_system = self.esxi.configManager.datastoreSystem
+        cluster_hosts = self.get_all_hosts_by_cluster(self.host_parent.name)
+        other_hosts = [host for host in cluster_hosts if host.name != self.esxi_hostname]
+        for host, error in rescan_hosts(self.content, other_hosts, self.new_device_names):
+            self.module.warn("Failed to rescan storage on host %s: %s" % (host.name, error))
+
+    def get_host_lun_names(self):
+        """SCSI LUN canonical names of the host, fetched once after the rescan."""
+        if self.host_lun_names is None:
+            self.host_lun_names = get_lun_names(self.content, [self.esxi]).get(self.esxi._moId, set())
+        return self.host_lun_names
+
+    def get_datastore_folder_children(self):
+        """Index the children of the 'datastore' folder by name, fetching all names in one call."""
+        if self.datastore_folder_children is None:
+            folders_by_name = get_folders_by_name(self.content)
+            children = folders_by_name['datastore'][1] if 'datastore' in folders_by_name else []
+            child_names = retrieve_properties(self.content, object_specs(children), vim.ManagedEntity, ['name'])
+            self.datastore_folder_children = dict((props['name'], child) for child, props in reversed(child_names))
+        return self.datastore_folder_children
+
+    def mount_san_datastore_host(self, spec, datastore):
+        datastore_name = spec['name']
+        # volume_device_name is already lowered in __init__
+        volume_device_name = spec['volume_device_name']
+        datastore_cluster_name = spec['datastore_cluster_name']
+        ds_path = "/vmfs/devices/disks/naa." + str(volume_device_name)
+        host_ds_system = self.host_ds_system
         ds_system = vim.host.DatastoreSystem
-        error_message_mount = "Cannot mount datastore %s on host %s" % (self.datastore_name, self.esxi_hostname)
+        error_message_mount = "Cannot mount datastore %s on host %s" % (datastore_name, self.esxi_hostname)
         try:
             if not datastore:
+                if "naa." + str(volume_device_name) not in self.get_host_lun_names():
+                    raise DatastoreError("%s : Device naa.%s is not visible on the host" % (error_message_mount,
+                                                                                          volume_device_name))
                 vmfs_ds_options = ds_system.QueryVmfsDatastoreCreateOptions(host_ds_system,
                                                                             ds_path)
-                vmfs_ds_options[0].spec.vmfs.volumeName = self.datastore_name
+                if not vmfs_ds_options:
+                    raise DatastoreError("%s : No VMFS create options for device %s" % (error_message_mount,
+                                                                                       ds_path))
+                vmfs_ds_options[0].spec.vmfs.volumeName = datastore_name
                 ds = ds_system.CreateVmfsDatastore(host_ds_system,
                                                    vmfs_ds_options[0].spec)
-                result_msg = "Datastore %s on host %s" % (self.datastore_name, self.esxi_hostname)
-                if self.datastore_cluster_name:
-                    #folders = self.content.viewManager.CreateContainerView(self.content.rootFolder, [vim.Folder], True).view
-                    folders = get_all_objs(self.content, [vim.Folder])
-                    dsfolder = [x for x in folders if x.name == 'datastore'][0]
-                    srcfolder = [x for x in dsfolder.childEntity if x.name == self.datastore_name][0]
-                    tgtfolder = [x for x in dsfolder.childEntity if x.name == self.datastore_cluster_name][0]
-                    task = tgtfolder.MoveIntoFolder_Task([srcfolder])
+                # Peer hosts must be rescanned for the new datastore even if a later step fails
+                self.new_device_names.add("naa." + str(volume_device_name))
+                result_msg = "Datastore %s on host %s" % (datastore_name, self.esxi_hostname)
+                if datastore_cluster_name:
+                    tgtfolder = self.get_datastore_folder_children().get(datastore_cluster_name)
+                    if tgtfolder is None:
+                        raise DatastoreError("%s : Failed to find datastore cluster %s" % (error_message_mount,
+                                                                                        datastore_cluster_name))
+                    task = tgtfolder.MoveIntoFolder_Task([ds])
+
+                    if self.async_poll:
+                        # Leave the move running, poll it with vmware_task_status
+                        return dict(datastore_name=datastore_name, changed=True, result=result_msg,
+                                    task_moid=task._moId)
 
                     success, result = wait_for_task(task)
-                    result_msg = "Datastore %s of cluster %s on host %s : %s" % (self.datastore_name,
-                                                                                 self.datastore_cluster_name,
+                    result_msg = "Datastore %s of cluster %s on host %s : %s" % (datastore_name,
+                                                                                 datastore_cluster_name,
                                                                                  self.esxi_hostname,
                                                                                  str(result))
 
-                self.rescan_other_hosts_in_cluster()
-                self.module.exit_json(changed=True, result=result_msg)
+                return dict(datastore_name=datastore_name, changed=True, result=result_msg)
 
-            existing_wwns = [x.diskName.split('.')[-1] for x in datastore.info.vmfs.extent]
-            if self.volume_device_name in existing_wwns:
+            existing_wwns = set(extract_wwns(datastore.info.vmfs.extent))
+            if volume_device_name in existing_wwns:
                 exp_options = host_ds_system.QueryVmfsDatastoreExpandOptions(datastore = datastore)
                 if len(exp_options) > 0:
-                    spec = [x.spec for x in exp_options if self.volume_device_name.lower() in x.spec.extent.diskName][0]
-                    host_ds_system.ExpandVmfsDatastore(datastore=datastore, spec=spec)
-                    result_msg = "Expanded storage on datastore %s" % (self.datastore_name)
-                    self.module.exit_json(changed=True, result=result_msg)
+                    expand_specs = [x.spec for x in exp_options if volume_device_name in x.spec.extent.diskName]
+                    if not expand_specs:
+                        raise DatastoreError("%s : No expand options for device naa.%s" % (error_message_mount,
+                                                                                          volume_device_name))
+                    host_ds_system.ExpandVmfsDatastore(datastore=datastore, spec=expand_specs[0])
+                    result_msg = "Expanded storage on datastore %s" % (datastore_name)
+                    return dict(datastore_name=datastore_name, changed=True, result=result_msg)
             else:
                 # TODO: Add missing WWN to datastore
                 pass
 
-            self.state_exit_unchanged()
+            return dict(datastore_name=datastore_name, changed=False)
 
         except (vim.fault.NotFound, vim.fault.DuplicateName,
                 vim.fault.HostConfigFault, vmodl.fault.InvalidArgument) as fault:
-            self.module.fail_json(msg="%s : %s" % (error_message_mount, to_native(fault.msg)))
-        except Exception as e:
-            self.module.fail_json(msg="%s : %s" % (error_message_mount, to_native(e)))
+            raise DatastoreError("%s : %s" % (error_message_mount, to_native(fault.msg)))
 
 
 def main():
     argument_spec = vmware_argument_spec()
     argument_spec.update(
         esxi_hostname=dict(type='str', required=True),
-        datastore_name=dict(type='str', required=True),
+        datastore_name=dict(type='str', required=False),
         datastore_cluster_name=dict(type='str', required=False),
         volume_device_name=dict(type='str'),
-        state=dict(type='str', default='present', choices=['absent', 'present'])
+        datastores=dict(type='list', elements='dict', required=False,
+                        options=dict(
+                            name=dict(type='str', required=True),
+                            volume_device_name=dict(type='str'),
+                            datastore_cluster_name=dict(type='str', required=False)
+                        )),
+        state=dict(type='str', default='present', choices=['absent', 'present']),
+        async_poll=dict(type='bool', default=False)
     )
 
     module = AnsibleModule(
         argument_spec=argument_spec,
+        required_one_of=[['datastore_name', 'datastores']],
+        mutually_exclusive=[['datastore_name', 'datastores'],
+                            ['volume_device_name', 'datastores'],
+                            ['datastore_cluster_name', 'datastores']],
         supports_check_mode=True,
     )
 
-    vmware_host_datastore_san = VMwareHostSanDatastore(module)
-    vmware_host_datastore_san.process_state()
+    try:
+        vmware_host_datastore_san = VMwareHostSanDatastore(module)
+        vmware_host_datastore_san.process_state()
+    except Exception as e:
+        module.fail_json(msg=to_native(e))
 
 
 if __name__ == '__main__':
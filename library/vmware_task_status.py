@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2018, Ansible Project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {
+    'metadata_version': '1.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = r'''
+---
+module: vmware_task_status
+short_description: Get the status of a vCenter task
+description:
+- This module returns the state of a vCenter task, for example one started by M(vmware_host_datastore_san) with C(async_poll).
+version_added: '0.2'
+author:
+- Harugop, Jayasheel <jch@hpe.com>
+- Avinash Jalumuru <avinash.jalumuru@hpe.com>
+notes:
+- Tested on vSphere 6.0 and 6.5
+requirements:
+- python >= 2.6
+- PyVmomi
+options:
+  task_moid:
+    description:
+    - Managed object id of the task, e.g. C(task-1234).
+    required: true
+  wait:
+    description:
+    - Wait for the task to complete before returning.
+    type: bool
+    default: false
+extends_documentation_fragment: vmware.documentation
+'''
+
+EXAMPLES = r'''
+- name: Mount VMFS datastore into a datastore cluster without waiting
+  vmware_host_datastore_san:
+      hostname: '{{ vcenter_hostname }}'
+      username: '{{ vcenter_user }}'
+      password: '{{ vcenter_pass }}'
+      datastore_name: San_datastore01
+      datastore_cluster_name: San_cluster01
+      volume_device_name: 'XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX'
+      esxi_hostname: '{{ inventory_hostname }}'
+      async_poll: true
+  delegate_to: localhost
+  register: mount
+
+- name: Wait for the datastore to be moved
+  vmware_task_status:
+      hostname: '{{ vcenter_hostname }}'
+      username: '{{ vcenter_user }}'
+      password: '{{ vcenter_pass }}'
+      task_moid: '{{ mount.results[0].task_moid }}'
+  delegate_to: localhost
+  register: move
+  until: move.state in ['success', 'error']
+  retries: 30
+  delay: 10
+'''
+
+RETURN = r'''
+state:
+    description: State of the task, one of queued, running, success or error.
+    returned: always
+    type: str
+    sample: success
+progress:
+    description: Progress of a running task in percent.
+    returned: always
+    type: int
+    sample: 40
+result:
+    description: Result of a completed task.
+    returned: always
+    type: str
+error:
+    description: Error message of a failed task.
+    returned: always
+    type: str
+'''
+
+try:
+    from pyVmomi import vim, vmodl
+    HAS_PYVMOMI = True
+except ImportError:
+    HAS_PYVMOMI = False
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.vmware import vmware_argument_spec, wait_for_task, TaskError
+from ansible.module_utils.vmware_san import PyVmomiSan
+from ansible.module_utils._text import to_native
+
+
+class VMwareTaskStatus(PyVmomiSan):
+    def __init__(self, module):
+        super(VMwareTaskStatus, self).__init__(module)
+
+        self.task_moid = module.params['task_moid']
+        self.wait = module.params['wait']
+
+    def gather_status(self):
+        task = vim.Task(self.task_moid, self.content.rootFolder._stub)
+        try:
+            if self.wait:
+                try:
+                    wait_for_task(task)
+                except TaskError:
+                    # The failure is reported through task.info below
+                    pass
+            info = task.info
+        except (vmodl.RuntimeFault, vmodl.MethodFault) as vmodl_fault:
+            self.module.fail_json(msg="Cannot get status of task %s: %s" % (self.task_moid,
+                                                                             to_native(vmodl_fault.msg)))
+
+        error = None
+        if info.error:
+            error = to_native(info.error.msg)
+        self.module.exit_json(changed=False,
+                              state=str(info.state),
+                              progress=info.progress,
+                              result=to_native(str(info.result)) if info.result is not None else None,
+                              error=error)
+
+
+def main():
+    argument_spec = vmware_argument_spec()
+    argument_spec.update(
+        task_moid=dict(type='str', required=True),
+        wait=dict(type='bool', default=False)
+    )
+
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+    )
+
+    if not HAS_PYVMOMI:
+        module.fail_json(msg='pyvmomi is required for this module')
+
+    try:
+        vmware_task_status = VMwareTaskStatus(module)
+        vmware_task_status.gather_status()
+    except Exception as e:
+        module.fail_json(msg=to_native(e))
+
+
+if __name__ == '__main__':
+    main()
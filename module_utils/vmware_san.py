@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2018, Ansible Project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Helpers shared by the vmware_*_san modules."""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import atexit
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import ssl
+import sys
+from operator import attrgetter
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+    HAS_FUTURES = True
+except ImportError:
+    # Python 2 without the futures backport, host calls run one after another
+    HAS_FUTURES = False
+
+try:
+    from pyVim.connect import Disconnect, SmartStubAdapter
+    from pyVmomi import vim, vmodl
+except ImportError:
+    pass
+
+from ansible.module_utils.vmware import HAS_PYVMOMI, PyVmomi, connect_to_api
+from ansible.module_utils._text import to_bytes, to_native
+
+MAX_PARALLEL_HOSTS = 32
+
+SESSION_HASH_ROUNDS = 100000
+
+# 'info' is fetched whole because 'vmfs' only exists on the VmfsDatastoreInfo subtype.
+DATASTORE_PROPERTIES = ['summary.name', 'summary.maintenanceMode', 'summary.url', 'parent', 'info']
+
+_get_disk_name = attrgetter('diskName')
+
+# Container views keyed by (id(content), vimtype names), destroyed at exit.
+_VIEW_CACHE = {}
+
+# Folder name -> (folder, childEntity) indexes keyed by id(content).
+_FOLDER_CACHE = {}
+
+
+def _session_file(module):
+    params = module.params
+    key = '%s:%s:%s' % (params['hostname'], params.get('port', 443), params['username'])
+    return os.path.join(os.path.expanduser('~/.ansible/tmp'),
+                        'vmware_session_%s' % hashlib.sha1(to_bytes(key)).hexdigest())
+
+
+def _password_hash(password, salt):
+    # Salted and slow, so the 0600 session file is no cheap password-guessing oracle
+    return binascii.hexlify(hashlib.pbkdf2_hmac('sha256', to_bytes(password), salt, SESSION_HASH_ROUNDS))
+
+
+def _read_session(module):
+    try:
+        with open(_session_file(module)) as session_file:
+            session = json.load(session_file)
+        return session['cookie'], binascii.unhexlify(session['salt']), to_bytes(session['password_hash'])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _resume_session(module):
+    """Return (si, content) reusing the session cookie saved by an earlier module run,
+    or None if there is no saved session for this password or it has expired."""
+    session = _read_session(module)
+    if session is None:
+        return None
+    cookie, salt, password_hash = session
+    if not cookie or not hmac.compare_digest(_password_hash(module.params['password'], salt), password_hash):
+        return None
+
+    ssl_context = None
+    if not module.params.get('validate_certs', True):
+        ssl_context = ssl._create_unverified_context()
+    try:
+        stub = SmartStubAdapter(host=module.params['hostname'], port=module.params.get('port', 443),
+                                poolSize=MAX_PARALLEL_HOSTS, sslContext=ssl_context)
+        stub.cookie = cookie
+        si = vim.ServiceInstance('ServiceInstance', stub)
+        content = si.RetrieveContent()
+        if content.sessionManager.currentSession is None:
+            return None
+    except (vmodl.MethodFault, EnvironmentError):
+        return None
+    return si, content
+
+
+def _save_session(module, si):
+    """Save the session cookie, returning True if the file now holds this session."""
+    path = _session_file(module)
+    salt = os.urandom(16)
+    session = dict(cookie=si._stub.cookie, salt=to_native(binascii.hexlify(salt)),
+                   password_hash=to_native(_password_hash(module.params['password'], salt)))
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), 0o700)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as session_file:
+            json.dump(session, session_file)
+    except (IOError, OSError):
+        return False
+    # Another run may have logged in at the same time and won the write
+    saved = _read_session(module)
+    return saved is not None and saved[0] == si._stub.cookie
+
+
+def connect_to_api_cached(module):
+    """Like connect_to_api, but resumes the vCenter session saved by an earlier
+    module run instead of logging in (and out) every time. Returns (si, content)."""
+    resumed = _resume_session(module)
+    if resumed is None:
+        si, content = connect_to_api(module, disconnect_atexit=False, return_si=True)
+        if not _save_session(module, si):
+            # Nobody can resume this session, so do not leave it open on vCenter
+            atexit.register(Disconnect, si)
+    else:
+        si, content = resumed
+    # Keep one idle keep-alive connection per worker thread instead of pyVmomi's default of 5
+    if getattr(si._stub, 'poolSize', MAX_PARALLEL_HOSTS) < MAX_PARALLEL_HOSTS:
+        si._stub.poolSize = MAX_PARALLEL_HOSTS
+    return si, content
+
+
+class PyVmomiSan(PyVmomi):
+    """PyVmomi base for the SAN modules, connected through connect_to_api_cached."""
+
+    def __init__(self, module):
+        if not HAS_PYVMOMI:
+            module.fail_json(msg='pyvmomi is required for this module')
+        # PyVmomi.__init__ always logs in, so set up its state here with a reused session instead
+        self.module = module
+        self.params = module.params
+        self.current_vm_obj = None
+        self.si, self.content = connect_to_api_cached(module)
+        self.custom_field_mgr = []
+
+
+def _destroy_cached_views():
+    for view, dummy in _VIEW_CACHE.values():
+        try:
+            view.DestroyView()
+        except Exception:
+            pass
+    _VIEW_CACHE.clear()
+
+
+atexit.register(_destroy_cached_views)
+
+
+def get_cached_objs(content, vimtype, refresh=False):
+    """Objects of vimtype from a cached ContainerView, re-read from the same view if refresh is set."""
+    key = (id(content), tuple(t.__name__ for t in vimtype))
+    if key not in _VIEW_CACHE:
+        view = content.viewManager.CreateContainerView(content.rootFolder, vimtype, True)
+        _VIEW_CACHE[key] = (view, list(view.view))
+    elif refresh:
+        view = _VIEW_CACHE[key][0]
+        _VIEW_CACHE[key] = (view, list(view.view))
+    return _VIEW_CACHE[key][1]
+
+
+def get_datastores_by_name(content, refresh=False):
+    """Index all datastores by name, using the cached view and one batched name fetch."""
+    datastores = get_cached_objs(content, [vim.Datastore], refresh=refresh)
+    ds_names = retrieve_properties(content, object_specs(datastores), vim.Datastore, ['name'])
+    return dict((props['name'], ds) for ds, props in reversed(ds_names))
+
+
+def object_specs(objects):
+    return [vmodl.query.PropertyCollector.ObjectSpec(obj=x, skip=False) for x in objects]
+
+
+def retrieve_properties(content, obj_specs, obj_type, path_set):
+    """Fetch path_set of every obj_type object reachable from obj_specs in one
+    RetrievePropertiesEx call, following continuation tokens.
+    Returns a list of (object, {property name: value}) tuples."""
+    if not obj_specs:
+        return []
+    pc = vmodl.query.PropertyCollector
+    filter_spec = pc.FilterSpec(objectSet=obj_specs,
+                                propSet=[pc.PropertySpec(type=obj_type, pathSet=path_set)])
+    collector = content.propertyCollector
+    result = collector.RetrievePropertiesEx([filter_spec], pc.RetrieveOptions())
+    objects = []
+    while result:
+        for obj_content in result.objects:
+            objects.append((obj_content.obj, dict((p.name, p.val) for p in obj_content.propSet or [])))
+        if not result.token:
+            break
+        result = collector.ContinueRetrievePropertiesEx(result.token)
+    return objects
+
+
+def get_folders_by_name(content):
+    key = id(content)
+    if key not in _FOLDER_CACHE:
+        pc = vmodl.query.PropertyCollector
+        folder_traversal = pc.TraversalSpec(name='folderTraversal', type=vim.Folder, path='childEntity', skip=False,
+                                            selectSet=[pc.SelectionSpec(name='folderTraversal'),
+                                                       pc.SelectionSpec(name='datacenterTraversal')])
+        datacenter_traversal = pc.TraversalSpec(name='datacenterTraversal', type=vim.Datacenter,
+                                                path='datastoreFolder', skip=False,
+                                                selectSet=[pc.SelectionSpec(name='folderTraversal')])
+        obj_spec = pc.ObjectSpec(obj=content.rootFolder, skip=False,
+                                 selectSet=[folder_traversal, datacenter_traversal])
+        folders = retrieve_properties(content, [obj_spec], vim.Folder, ['name', 'childEntity'])
+        _FOLDER_CACHE[key] = dict((props['name'], (folder, props.get('childEntity', [])))
+                                  for folder, props in reversed(folders))
+    return _FOLDER_CACHE[key]
+
+
+class _SerialFuture(object):
+    """Completed stand-in for a Future, used when concurrent.futures is missing."""
+
+    def __init__(self, func, item):
+        self._value = None
+        self._exc_info = None
+        try:
+            self._value = func(item)
+        except Exception:
+            self._exc_info = sys.exc_info()
+
+    def result(self):
+        if self._exc_info:
+            raise self._exc_info[1]
+        return self._value
+
+
+def run_in_parallel(func, items):
+    """Call func on every item concurrently and return the futures in item order."""
+    if not items:
+        return []
+    if not HAS_FUTURES:
+        return [_SerialFuture(func, item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_HOSTS, len(items))) as executor:
+        return [executor.submit(func, item) for item in items]
+
+
+def extract_wwns(extents):
+    """Return the WWN part of each extent disk name, e.g. 'naa.<wwn>' -> '<wwn>'."""
+    return [name.rpartition('.')[2] for name in map(_get_disk_name, extents)]
+
+
+def read_datastores(content, datastores):
+    """Return the facts dict of every datastore, using one property fetch for the
+    datastores and one for the names of their datastore clusters."""
+    ds_props = retrieve_properties(content, object_specs(datastores), vim.Datastore, DATASTORE_PROPERTIES)
+
+    # Resolve datastore cluster names with one more call, only for StoragePod parents
+    storage_pods = dict((x['parent']._moId, x['parent']) for dummy, x in ds_props
+                        if isinstance(x.get('parent'), vim.StoragePod))
+    pod_props = retrieve_properties(content, object_specs(storage_pods.values()), vim.StoragePod, ['name'])
+    pod_names = dict((pod._moId, props['name']) for pod, props in pod_props)
+
+    facts = list()
+    for dummy, props in ds_props:
+        ds = {}
+        ds['name'] = props['summary.name']
+        ds['maintenanceMode'] = props.get('summary.maintenanceMode')
+        ds['url'] = props.get('summary.url')
+        ds['datastore_cluster'] = 'N/A'
+        parent = props.get('parent')
+        if isinstance(parent, vim.StoragePod):
+            ds['datastore_cluster'] = pod_names.get(parent._moId, 'N/A')
+
+        vmfs = props['info'].vmfs
+        ds['vmfs_type'] = vmfs.type
+        ds['wwn'] = extract_wwns(vmfs.extent)
+        facts.append(ds)
+    return facts
+
+
+def get_lun_names(content, hosts):
+    """Return {host moId: set of SCSI LUN canonical names} for hosts, fetched in one call."""
+    host_luns = retrieve_properties(content, object_specs(hosts), vim.HostSystem, ['config.storageDevice.scsiLun'])
+    return dict((host._moId, set(x.canonicalName for x in props.get('config.storageDevice.scsiLun') or []))
+                for host, props in host_luns)
+
+
+def rescan_hosts(content, hosts, device_names):
+    """Rescan HBAs and VMFS on hosts in parallel. HBAs are only rescanned on hosts
+    that do not list all of device_names yet. Returns (host, error message) for every failed host."""
+    # Hosts that already list every new LUN only need a VMFS rescan to pick up the datastore
+    host_luns = get_lun_names(content, hosts)
+    hosts_with_luns = set(moid for moid, lun_names in host_luns.items() if set(device_names).issubset(lun_names))
+
+    def rescan(host):
+        storage_system = host.configManager.storageSystem
+        if host._moId not in hosts_with_luns:
+            storage_system.RescanAllHba()
+        storage_system.RescanVmfs()
+
+    failures = []
+    for host, future in zip(hosts, run_in_parallel(rescan, hosts)):
+        try:
+            future.result()
+        except (vmodl.RuntimeFault, vmodl.MethodFault) as fault:
+            failures.append((host, to_native(fault.msg)))
+        except EnvironmentError as e:
+            # Socket and SSL errors on one host must not stop the rescan of the others
+            failures.append((host, to_native(e)))
+    return failures